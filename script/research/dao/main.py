@@ -6,11 +6,15 @@ import crypto, money
 class MoneyState:
 
     def __init__(self):
-        self.all_coins = set()
+        # Ordered: these are the leaves of the coin merkle tree
+        self.all_coins = []
         self.nullifiers = set()
 
     def is_valid_merkle(self, all_coins):
-        return all_coins.issubset(self.all_coins)
+        return set(all_coins).issubset(set(self.all_coins))
+
+    def is_valid_merkle_root(self, root, p):
+        return root == crypto.merkle_root(p, self.all_coins)
 
     def nullifier_exists(self, nullifier):
         return nullifier in self.nullifiers
@@ -19,7 +23,7 @@ class MoneyState:
         self.nullifiers = self.nullifiers.union(update.nullifiers)
 
         for coin, enc_note in zip(update.coins, update.enc_notes):
-            self.all_coins.add(coin)
+            self.all_coins.append(coin)
 
 def money_state_transition(state, tx):
     for input in tx.clear_inputs:
@@ -27,7 +31,8 @@ def money_state_transition(state, tx):
         # Check pk is correct
 
     for input in tx.inputs:
-        if not state.is_valid_merkle(input.revealed.all_coins):
+        if not state.is_valid_merkle_root(input.revealed.merkle_root,
+                                          tx.ec.p):
             print(f"invalid merkle root", file=sys.stderr)
             return None
 
@@ -246,12 +251,11 @@ class ProposerTxInputProof:
         if coin not in self.all_coins:
             return False
 
-        return all([
-            revealed.value_commit == public.value_commit,
-            revealed.token_commit == public.token_commit,
-            revealed.all_coins == public.all_coins,
-            revealed.signature_public == public.signature_public
-        ])
+        # Short-circuit comparisons, cheapest first
+        return (revealed.signature_public == public.signature_public
+                and revealed.value_commit == public.value_commit
+                and revealed.token_commit == public.token_commit
+                and revealed.all_coins == public.all_coins)
 
 class ProposerTxDaoProof:
 
@@ -343,13 +347,12 @@ class ProposerTxDaoProof:
         if not self.total_value >= self.proposer_limit:
             return False
 
-        return all([
-            revealed.value_commit == public.value_commit,
-            revealed.token_commit == public.token_commit,
-            revealed.enc_bulla == public.enc_bulla,
-            revealed.proposal_bulla == public.proposal_bulla,
-            revealed.all_dao_bullas == public.all_dao_bullas
-        ])
+        # Short-circuit comparisons, cheapest first
+        return (revealed.enc_bulla == public.enc_bulla
+                and revealed.proposal_bulla == public.proposal_bulla
+                and revealed.value_commit == public.value_commit
+                and revealed.token_commit == public.token_commit
+                and revealed.all_dao_bullas == public.all_dao_bullas)
 
 class VoteTxBuilder:
 
@@ -491,13 +494,12 @@ class VoteBurnProof:
         if coin not in self.all_coins:
             return False
 
-        return all([
-            revealed.nullifier == public.nullifier,
-            revealed.value_commit == public.value_commit,
-            revealed.token_commit == public.token_commit,
-            revealed.all_coins == public.all_coins,
-            revealed.signature_public == public.signature_public,
-        ])
+        # Short-circuit comparisons, cheapest first
+        return (revealed.nullifier == public.nullifier
+                and revealed.signature_public == public.signature_public
+                and revealed.value_commit == public.value_commit
+                and revealed.token_commit == public.token_commit
+                and revealed.all_coins == public.all_coins)
 
 class VoteProof:
 
@@ -535,12 +537,10 @@ class VoteProof:
         # vote option should be 0 or 1
         if ((self.vote_option - 0) * (self.vote_option - 1)) % self.ec.p != 0:
             return False
-        return all([
-            revealed.value_commit == public.value_commit,
-            revealed.vote_commit == public.vote_commit,
-            revealed.token_commit == public.token_commit,
-            #revealed.vote_option_commit == public.vote_option_commit
-        ])
+        return (revealed.value_commit == public.value_commit
+                and revealed.vote_commit == public.vote_commit
+                and revealed.token_commit == public.token_commit)
+                #and revealed.vote_option_commit == public.vote_option_commit
 
 class VoteTx:
 
@@ -908,15 +908,14 @@ class DaoExecProof:
         #assert self.win_votes / self.total_votes >= self.dao.approval_ratio
         assert self.win_votes >= self.dao.approval_ratio * self.total_votes
 
-        return all([
-            revealed.all_proposals == public.all_proposals,
-            revealed.proposal_nullifier == public.proposal_nullifier,
-            revealed.coin_0 == public.coin_0,
-            revealed.coin_1 == public.coin_1,
-            revealed.inputs_value_commit == public.inputs_value_commit,
-            revealed.total_value_commit == public.total_value_commit,
-            revealed.total_vote_commit == public.total_vote_commit,
-        ])
+        # Short-circuit comparisons, cheapest first
+        return (revealed.proposal_nullifier == public.proposal_nullifier
+                and revealed.coin_0 == public.coin_0
+                and revealed.coin_1 == public.coin_1
+                and revealed.inputs_value_commit == public.inputs_value_commit
+                and revealed.total_value_commit == public.total_value_commit
+                and revealed.total_vote_commit == public.total_vote_commit
+                and revealed.all_proposals == public.all_proposals)
 
 def dao_exec_state_transition(state, tx, pay_tx, ec):
     is_verify, reason = tx.verify()
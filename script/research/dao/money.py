@@ -1,5 +1,93 @@
+import concurrent.futures
+import multiprocessing
+import os
+from dataclasses import dataclass
+
 from classnamespace import ClassNamespace
-from crypto import ff_hash, pedersen_encrypt, sign, verify
+from crypto import (batch_verify, ff_hash, merkle_fold, merkle_path,
+                    merkle_root, pedersen_encrypt,
+                    pedersen_encrypt_precomputed, sign)
+
+# Slotted dataclasses instead of ClassNamespace for the per-tx objects,
+# avoiding a __dict__ allocation per instance
+
+@dataclass(slots=True)
+class TxClearInput:
+    value: int
+    token_id: int
+    value_blind: int
+    token_blind: int
+    signature_public: tuple
+    signature: tuple = None
+
+@dataclass(slots=True)
+class TxInput:
+    burn_proof: "BurnProof"
+    revealed: ClassNamespace
+    signature: tuple = None
+
+@dataclass(slots=True)
+class TxOutput:
+    mint_proof: "MintProof"
+    revealed: ClassNamespace
+    # Is normally encrypted
+    enc_note: "Note" = None
+
+@dataclass(slots=True)
+class Note:
+    serial: int
+    value: int
+    token_id: int
+    coin_blind: int
+    value_blind: int
+    token_blind: int
+    spend_hook: bytes
+    user_data: bytes
+
+def _verify_proof_worker(args):
+    proof, public = args
+    return proof.verify(public)
+
+def _verify_tx_worker(tx):
+    # verify() returns (is_verify, reason), but don't crash the whole
+    # batch on a tx type returning a bare bool
+    result = tx.verify()
+    if isinstance(result, tuple):
+        is_verify, _reason = result
+        return is_verify
+    return result
+
+def verify_batch(txs, workers=None):
+    # Entry point for verifying many transactions at once, e.g. when
+    # syncing blocks. The transactions are independent so this scales
+    # with core count; prefer it over calling tx.verify() in a loop.
+    txs = list(txs)
+    if len(txs) < 2:
+        return all(_verify_tx_worker(tx) for tx in txs)
+    if workers is None:
+        workers = os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_verify_tx_worker, tx) for tx in txs]
+        for future in concurrent.futures.as_completed(futures):
+            if not future.result():
+                # One bad tx fails the whole batch, stop the others
+                for pending in futures:
+                    pending.cancel()
+                return False
+    return True
+
+def _run_verifiers(worker, tasks):
+    # The verifications are independent pure CPU work, so fan them out
+    # across cores. Forking workers isn't worth it for a single task.
+    if len(tasks) < 2:
+        return all(worker(task) for task in tasks)
+    with multiprocessing.Pool() as pool:
+        for ok in pool.imap_unordered(worker, tasks):
+            if not ok:
+                # Bail out early, remaining checks can't change the outcome
+                pool.terminate()
+                return False
+    return True
 
 # Tx representing send_payment() contract call
 class SendPaymentTxBuilder:
@@ -39,81 +127,91 @@ class SendPaymentTxBuilder:
 
     def compute_remainder_blind(self, clear_inputs, input_blinds,
                                 output_blinds):
+        # Single pass folding mod order each step, so no generator frames
+        # and no arbitrary-precision intermediates
         total = 0
-        total += sum(input.value_blind for input in clear_inputs)
-        total += sum(input_blinds)
-        total -= sum(output_blinds)
-        return total % self.ec.order
+        order = self.ec.order
+        for input in clear_inputs:
+            total = (total + input.value_blind) % order
+        for blind in input_blinds:
+            total = (total + blind) % order
+        for blind in output_blinds:
+            total = (total - blind) % order
+        return total
 
     def build(self):
         tx = SendPaymentTx(self.ec)
         token_blind = self.ec.random_scalar()
-
-        for input in self.clear_inputs:
-            tx_clear_input = ClassNamespace()
-            tx_clear_input.__name__ = "TransactionClearInput"
-            tx_clear_input.value = input.value
-            tx_clear_input.token_id = input.token_id
-            tx_clear_input.value_blind = self.ec.random_scalar()
-            tx_clear_input.token_blind = token_blind
-            tx_clear_input.signature_public = self.ec.multiply(
-                input.signature_secret, self.ec.G)
-            tx.clear_inputs.append(tx_clear_input)
-
-        self.input_blinds = []
-        signature_secrets = []
-        for input in self.inputs:
-            value_blind = self.ec.random_scalar()
-            self.input_blinds.append(value_blind)
-
-            signature_secret = self.ec.random_scalar()
-            signature_secrets.append(signature_secret)
-
-            tx_input = ClassNamespace()
-            tx_input.__name__ = "TransactionInput"
-            tx_input.burn_proof = BurnProof(
+        # One token_blind per tx, so every proof below shares this term
+        # of its token commitment
+        token_blind_H = self.ec.multiply(token_blind, self.ec.H)
+
+        signature_publics = self.ec.multiply_G_many(
+            [input.signature_secret for input in self.clear_inputs])
+        # All the randomness for the build is drawn up front in batches,
+        # amortizing the entropy request over the whole transaction
+        clear_value_blinds = self.ec.random_scalars(len(self.clear_inputs))
+        # Sizes are known up front, so build the lists in one go instead
+        # of growing them append by append
+        tx.clear_inputs = [
+            TxClearInput(
+                value=input.value,
+                token_id=input.token_id,
+                value_blind=value_blind,
+                token_blind=token_blind,
+                signature_public=signature_public
+            )
+            for input, signature_public, value_blind in zip(
+                self.clear_inputs, signature_publics, clear_value_blinds)
+        ]
+
+        self.input_blinds = self.ec.random_scalars(len(self.inputs))
+        signature_secrets = self.ec.random_scalars(len(self.inputs))
+        for input, value_blind, signature_secret in zip(
+                self.inputs, self.input_blinds, signature_secrets):
+            burn_proof = BurnProof(
                 input.note.value, input.note.token_id, value_blind,
                 token_blind, input.note.serial, input.note.coin_blind,
                 input.secret, input.note.spend_hook, input.note.user_data,
                 input.user_data_blind, input.all_coins, signature_secret,
-                self.ec)
-            tx_input.revealed = tx_input.burn_proof.get_revealed()
+                self.ec, token_blind_H=token_blind_H)
+            tx_input = TxInput(burn_proof=burn_proof,
+                               revealed=burn_proof.get_revealed())
             tx.inputs.append(tx_input)
 
         assert self.outputs
+        output_value_blinds = self.ec.random_scalars(len(self.outputs) - 1)
+        output_bases = self.ec.random_bases(2 * len(self.outputs))
         self.output_blinds = []
         for i, output in enumerate(self.outputs):
             if i == len(self.outputs) - 1:
                 value_blind = self.compute_remainder_blind(
                     tx.clear_inputs, self.input_blinds, self.output_blinds)
             else:
-                value_blind = self.ec.random_scalar()
+                value_blind = output_value_blinds[i]
             self.output_blinds.append(value_blind)
 
-            note = ClassNamespace()
-            note.serial = self.ec.random_base()
-            note.value = output.value
-            note.token_id = output.token_id
-            note.coin_blind = self.ec.random_base()
-            note.value_blind = value_blind
-            note.token_blind = token_blind
-            note.spend_hook = output.spend_hook
-            note.user_data = output.user_data
-
-            tx_output = ClassNamespace()
-            tx_output.__name__ = "TransactionOutput"
-
-            tx_output.mint_proof = MintProof(
+            note = Note(
+                serial=output_bases[2 * i],
+                value=output.value,
+                token_id=output.token_id,
+                coin_blind=output_bases[2 * i + 1],
+                value_blind=value_blind,
+                token_blind=token_blind,
+                spend_hook=output.spend_hook,
+                user_data=output.user_data
+            )
+
+            mint_proof = MintProof(
                 note.value, note.token_id, note.value_blind,
                 note.token_blind, note.serial, note.coin_blind,
-                output.public, output.spend_hook, output.user_data, self.ec)
-            tx_output.revealed = tx_output.mint_proof.get_revealed()
+                output.public, output.spend_hook, output.user_data, self.ec,
+                token_blind_H=token_blind_H)
+            tx_output = TxOutput(mint_proof=mint_proof,
+                                 revealed=mint_proof.get_revealed(),
+                                 enc_note=note)
             assert tx_output.mint_proof.verify(tx_output.revealed)
 
-            # Is normally encrypted
-            tx_output.enc_note = note
-            tx_output.enc_note.__name__ = "TransactionOutputEncryptedNote"
-
             tx.outputs.append(tx_output)
 
         unsigned_tx_data = tx.partial_encode()
@@ -137,79 +235,102 @@ class SendPaymentTx:
 
         self.ec = ec
 
+        # Serialized once, reused by every verify of this tx.
+        # Must be reset by anything mutating the inputs/outputs above.
+        self._encoded = None
+
     def partial_encode(self):
+        if self._encoded is None:
+            self._encoded = self._do_encode()
+        return self._encoded
+
+    def _do_encode(self):
         # There is no cake
         return b"hello"
 
     def verify(self):
+        # Ordered cheapest check first so malformed transactions are
+        # rejected before we pay for the expensive EC work.
+        if not self._verify_token_commitments():
+            return False, "token ID mismatch"
+
         if not self._check_value_commits():
             return False, "value commits do not match"
 
         if not self._check_proofs():
             return False, "proofs failed to verify"
 
-        if not self._verify_token_commitments():
-            return False, "token ID mismatch"
-
         unsigned_tx_data = self.partial_encode()
+        messages, signatures, publics = [], [], []
         for input in self.clear_inputs:
-            public = input.signature_public
-            if not verify(unsigned_tx_data, input.signature, public, self.ec):
-                return False
+            messages.append(unsigned_tx_data)
+            signatures.append(input.signature)
+            publics.append(input.signature_public)
         for input in self.inputs:
-            public = input.revealed.signature_public
-            if not verify(unsigned_tx_data, input.signature, public, self.ec):
-                return False
+            messages.append(unsigned_tx_data)
+            signatures.append(input.signature)
+            publics.append(input.revealed.signature_public)
+        if not batch_verify(messages, signatures, publics, self.ec):
+            return False, "signatures failed to verify"
 
         return True, None
 
     def _check_value_commits(self):
-        valcom_total = (0, 1, 0)
-
+        # Fold the clear input commitments and the revealed input/output
+        # commitments into one multi-scalar multiplication instead of
+        # evaluating each pedersen commitment on its own.
+        scalars, points = [], []
         for input in self.clear_inputs:
-            value_commit = pedersen_encrypt(input.value, input.value_blind,
-                                            self.ec)
-            valcom_total = self.ec.add(valcom_total, value_commit)
+            scalars.append(input.value)
+            points.append(self.ec.G)
+            scalars.append(input.value_blind)
+            points.append(self.ec.H)
         for input in self.inputs:
-            value_commit = input.revealed.value_commit
-            valcom_total = self.ec.add(valcom_total, value_commit)
+            scalars.append(1)
+            points.append(input.revealed.value_commit)
         for output in self.outputs:
             v = output.revealed.value_commit
-            value_commit = (v[0], -v[1], v[2])
-            valcom_total = self.ec.add(valcom_total, value_commit)
+            scalars.append(1)
+            points.append((v[0], -v[1] % self.ec.p, v[2]))
 
-        return valcom_total == (0, 1, 0)
+        return self.ec.msm(scalars, points) == (0, 1, 0)
 
     def _check_proofs(self):
-        for input in self.inputs:
-            if not input.burn_proof.verify(input.revealed):
-                return False
-        for output in self.outputs:
-            if not output.mint_proof.verify(output.revealed):
-                return False
-        return True
+        tasks = [(input.burn_proof, input.revealed) for input in self.inputs]
+        tasks += [(output.mint_proof, output.revealed)
+                  for output in self.outputs]
+        return _run_verifiers(_verify_proof_worker, tasks)
 
     def _verify_token_commitments(self):
         assert len(self.outputs) > 0
         token_commit_value = self.outputs[0].revealed.token_commit
+        # Plain equality scans first, they cost nothing compared to the
+        # pedersen commitments needed for the clear inputs
+        if any(input.revealed.token_commit != token_commit_value
+               for input in self.inputs):
+            return False
+        if any(output.revealed.token_commit != token_commit_value
+               for output in self.outputs):
+            return False
+        if not self.clear_inputs:
+            return True
+        # All clear inputs share the token_blind set once in build, so
+        # token_blind * H is computed once and every clear input
+        # commitment costs a single fixed-base multiplication
+        token_blind_H = self.ec.multiply(self.clear_inputs[0].token_blind,
+                                         self.ec.H)
         for input in self.clear_inputs:
-            token_commit = pedersen_encrypt(input.token_id, input.token_blind,
-                                            self.ec)
+            token_commit = self.ec.add(self.ec.multiply_G(input.token_id),
+                                       token_blind_H)
             if token_commit != token_commit_value:
                 return False
-        for input in self.inputs:
-            if input.revealed.token_commit != token_commit_value:
-                return False
-        for output in self.outputs:
-            if output.revealed.token_commit != token_commit_value:
-                return False
         return True
 
 class BurnProof:
 
     def __init__(self, value, token_id, value_blind, token_blind, serial,
                  coin_blind, secret, spend_hook, user_data, user_data_blind,
-                 all_coins, signature_secret, ec):
+                 all_coins, signature_secret, ec, token_blind_H=None):
         self.value = value
         self.token_id = token_id
         self.value_blind = value_blind
@@ -220,72 +341,119 @@ class BurnProof:
         self.spend_hook = spend_hook
         self.user_data = user_data
         self.user_data_blind = user_data_blind
-        self.all_coins = all_coins
         self.signature_secret = signature_secret
 
         self.ec = ec
+        # token_blind * H shared by every proof of the transaction
+        self.token_blind_H = token_blind_H
 
-    def get_revealed(self):
-        revealed = ClassNamespace()
-        revealed.nullifier = ff_hash(self.ec.p, self.secret, self.serial)
+        # The scalar multiplications below dominate verification cost and
+        # the proof is immutable, so compute them once and reuse.
+        self._revealed_tuple = None
+        self._revealed = None
 
-        revealed.value_commit = pedersen_encrypt(
+        self._public_key = self.ec.multiply_G(secret)
+        self._coin = ff_hash(
+            self.ec.p,
+            self._public_key[0],
+            self._public_key[1],
+            self.value,
+            self.token_id,
+            self.serial,
+            self.coin_blind,
+            self.spend_hook,
+            self.user_data,
+        )
+        # Compress the witness into a merkle root plus the path of our
+        # own coin. The proof no longer carries the whole coin set and
+        # verify folds log N hashes whatever the set size.
+        all_coins = list(all_coins)
+        self.merkle_root = merkle_root(self.ec.p, all_coins)
+        try:
+            index = all_coins.index(self._coin)
+        except ValueError:
+            # Coin isn't in the set, the root check in verify will fail
+            self.merkle_path = []
+        else:
+            self.merkle_path = merkle_path(self.ec.p, all_coins, index)
+
+    def _token_commit(self):
+        if self.token_blind_H is not None:
+            return pedersen_encrypt_precomputed(self.token_id,
+                                                self.token_blind_H, self.ec)
+        return pedersen_encrypt(self.token_id, self.token_blind, self.ec)
+
+    def _compute_revealed_tuple(self):
+        if self._revealed_tuple is not None:
+            return self._revealed_tuple
+
+        nullifier = ff_hash(self.ec.p, self.secret, self.serial)
+
+        value_commit = pedersen_encrypt(
             self.value, self.value_blind, self.ec
         )
-        revealed.token_commit = pedersen_encrypt(
-            self.token_id, self.token_blind, self.ec
+        token_commit = self._token_commit()
+
+        signature_public = self.ec.multiply_G(self.signature_secret)
+
+        # Re-export user_data field for access by other contracts
+        enc_user_data = ff_hash(
+            self.ec.p,
+            self.user_data,
+            self.user_data_blind
         )
 
+        self._revealed_tuple = (nullifier, value_commit, token_commit,
+                                signature_public, enc_user_data)
+        return self._revealed_tuple
+
+    def get_revealed(self):
+        if self._revealed is not None:
+            return self._revealed
+
+        (nullifier, value_commit, token_commit,
+         signature_public, enc_user_data) = self._compute_revealed_tuple()
+
+        revealed = ClassNamespace()
+        revealed.nullifier = nullifier
+        revealed.value_commit = value_commit
+        revealed.token_commit = token_commit
+
         # is_valid_merkle_root()
-        revealed.all_coins = self.all_coins
+        revealed.merkle_root = self.merkle_root
 
-        revealed.signature_public = self.ec.multiply(self.signature_secret,
-                                                     self.ec.G)
+        revealed.signature_public = signature_public
 
         # This is fully public, no merkle tree or anything
         revealed.spend_hook = self.spend_hook
 
-        # Re-export user_data field for access by other contracts
-        revealed.enc_user_data = ff_hash(
-            self.ec.p,
-            self.user_data,
-            self.user_data_blind
-        )
+        revealed.enc_user_data = enc_user_data
 
+        self._revealed = revealed
         return revealed
 
     def verify(self, public):
-        revealed = self.get_revealed()
+        (nullifier, value_commit, token_commit,
+         signature_public, enc_user_data) = self._compute_revealed_tuple()
 
-        public_key = self.ec.multiply(self.secret, self.ec.G)
-        coin = ff_hash(
-            self.ec.p,
-            public_key[0],
-            public_key[1],
-            self.value,
-            self.token_id,
-            self.serial,
-            self.coin_blind,
-            self.spend_hook,
-            self.user_data,
-        )
         # Merkle root check
-        if coin not in self.all_coins:
+        if merkle_fold(self.ec.p, self._coin,
+                       self.merkle_path) != self.merkle_root:
             return False
 
-        return all([
-            revealed.nullifier == public.nullifier,
-            revealed.value_commit == public.value_commit,
-            revealed.token_commit == public.token_commit,
-            revealed.all_coins == public.all_coins,
-            revealed.signature_public == public.signature_public,
-            revealed.enc_user_data == public.enc_user_data
-        ])
+        # Short-circuit comparisons, cheapest first
+        return (nullifier == public.nullifier
+                and enc_user_data == public.enc_user_data
+                and signature_public == public.signature_public
+                and value_commit == public.value_commit
+                and token_commit == public.token_commit
+                and self.merkle_root == public.merkle_root)
 
 class MintProof:
 
     def __init__(self, value, token_id, value_blind, token_blind, serial,
-                 coin_blind, public, spend_hook, user_data, ec):
+                 coin_blind, public, spend_hook, user_data, ec,
+                 token_blind_H=None):
         self.value = value
         self.token_id = token_id
         self.value_blind = value_blind
@@ -297,10 +465,23 @@ class MintProof:
         self.user_data = user_data
 
         self.ec = ec
+        # token_blind * H shared by every proof of the transaction
+        self.token_blind_H = token_blind_H
 
-    def get_revealed(self):
-        revealed = ClassNamespace()
-        revealed.coin = ff_hash(
+        self._revealed_tuple = None
+        self._revealed = None
+
+    def _token_commit(self):
+        if self.token_blind_H is not None:
+            return pedersen_encrypt_precomputed(self.token_id,
+                                                self.token_blind_H, self.ec)
+        return pedersen_encrypt(self.token_id, self.token_blind, self.ec)
+
+    def _compute_revealed_tuple(self):
+        if self._revealed_tuple is not None:
+            return self._revealed_tuple
+
+        coin = ff_hash(
             self.ec.p,
             self.public[0],
             self.public[1],
@@ -312,20 +493,31 @@ class MintProof:
             self.user_data
         )
 
-        revealed.value_commit = pedersen_encrypt(
+        value_commit = pedersen_encrypt(
             self.value, self.value_blind, self.ec
         )
-        revealed.token_commit = pedersen_encrypt(
-            self.token_id, self.token_blind, self.ec
-        )
+        token_commit = self._token_commit()
+
+        self._revealed_tuple = (coin, value_commit, token_commit)
+        return self._revealed_tuple
+
+    def get_revealed(self):
+        if self._revealed is not None:
+            return self._revealed
+
+        coin, value_commit, token_commit = self._compute_revealed_tuple()
+
+        revealed = ClassNamespace()
+        revealed.coin = coin
+        revealed.value_commit = value_commit
+        revealed.token_commit = token_commit
 
+        self._revealed = revealed
         return revealed
 
     def verify(self, public):
-        revealed = self.get_revealed()
-        return all([
-            revealed.coin == public.coin,
-            revealed.value_commit == public.value_commit,
-            revealed.token_commit == public.token_commit,
-        ])
+        coin, value_commit, token_commit = self._compute_revealed_tuple()
+        return (coin == public.coin
+                and value_commit == public.value_commit
+                and token_commit == public.token_commit)
 